@@ -6,16 +6,17 @@ from __future__ import annotations
 import copy
 from dataclasses import dataclass
 from enum import Enum
-import json
 import logging
 import os
 from pathlib import Path
+import threading
 import time
 from typing import Any, Dict, Iterable, Optional, List, Tuple, Union
 
 from django.conf import settings
 from django.core.cache import cache
 from django.utils import translation
+import orjson
 from pydantic.error_wrappers import ValidationError
 
 from util.files import read_meta
@@ -31,6 +32,13 @@ INDEX = "index"
 
 LOGGER = logging.getLogger('main')
 
+# Configs loaded by this process. Getting a config from the Django cache
+# unpickles the whole course, which is slow for large courses, so the
+# configs are first looked up here. The same objects are then used by every
+# request of the process, so they must not be modified.
+_process_cache: Dict[str, "CourseConfig"] = {}
+_process_cache_lock = threading.Lock()
+
 
 def _type_dict(dict_item: Dict[str, Any], dict_types: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
     '''
@@ -43,10 +51,12 @@ def _type_dict(dict_item: Dict[str, Any], dict_types: Dict[str, Dict[str, Any]])
     @return: an extended dictionary
     '''
     # TODO: should probably throw an error if type isn't in dict_types
-    if "type" not in dict_item or dict_item["type"] not in dict_types:
+    type_name = dict_item.get("type")
+    if type_name is None or type_name not in dict_types:
         return dict_item
-    base = copy.deepcopy(dict_types[dict_item["type"]])
-    base.update(dict_item)
+    # A shallow copy is enough: the result is only read when parsing the config
+    # into pydantic models, which copy the nested values into new objects
+    base = {**dict_types[type_name], **dict_item}
     del base["type"]
     return base
 
@@ -113,7 +123,11 @@ class CourseConfig:
         return exercise.data_for_language(lang)
 
 
-    def exercise_config(self, exercise_key: str) -> Optional[ExerciseConfig]:
+    def exercise_config(
+            self,
+            exercise_key: str,
+            include_mtimes: Optional[Dict[str, Optional[float]]] = None,
+            ) -> Optional[ExerciseConfig]:
         '''
         Gets exercise dictionary root (meta and data).
 
@@ -121,6 +135,9 @@ class CourseConfig:
         @param course_root: a course root dictionary
         @type exercise_key: C{str}
         @param exercise_key: an exercise key
+        @type include_mtimes: C{dict}
+        @param include_mtimes: modification times of the included files, shared
+            between calls so that each file is checked only once
         @rtype: C{dict}
         @return: exercise root or None
         '''
@@ -130,7 +147,7 @@ class CourseConfig:
         # Try cached version.
         if exercise_key in self.exercises:
             exercise_root = self.exercises[exercise_key]._config_obj
-            include_ok = self._check_include_file_timestamps(exercise_root)
+            include_ok = self._check_include_file_timestamps(exercise_root, include_mtimes)
             try:
                 if (exercise_root.mtime >= os.path.getmtime(exercise_root.file)
                         and include_ok):
@@ -206,6 +223,8 @@ class CourseConfig:
 
         destination_key = CourseConfig.cache_key(config.key, destination)
         cache.set(destination_key, config)
+        with _process_cache_lock:
+            _process_cache.pop(destination_key, None)
 
     @staticmethod
     def relative_path_to(key: str = "", *paths: str) -> str:
@@ -277,7 +296,11 @@ class CourseConfig:
     @staticmethod
     def get_many(course_keys: Iterable[str], source: ConfigSource = ConfigSource.PUBLISH) -> Tuple[List[CourseConfig], List[str]]:
         course_keys = list(course_keys)
-        config_map = cache.get_many(CourseConfig.cache_key(key, source) for key in course_keys)
+        cache_keys = [CourseConfig.cache_key(key, source) for key in course_keys]
+        config_map = CourseConfig._get_many_from_process_cache(cache_keys)
+        missing_keys = [key for key in cache_keys if key not in config_map]
+        if missing_keys:
+            config_map.update(cache.get_many(missing_keys))
 
         loaded_configs = {}
         configs = []
@@ -301,6 +324,7 @@ class CourseConfig:
                 else:
                     loaded_configs[cache_key] = config
 
+            CourseConfig._set_to_process_cache(cache_key, config)
             configs.append(config)
             warnings = validation_warning_str(config)
             if warnings:
@@ -323,6 +347,20 @@ class CourseConfig:
     def cache_key(course_key: str, source: ConfigSource = ConfigSource.PUBLISH):
         return f"{source.value}|{course_key}"
 
+    @staticmethod
+    def _get_many_from_process_cache(cache_keys: Iterable[str]) -> Dict[str, CourseConfig]:
+        with _process_cache_lock:
+            return {
+                key: _process_cache[key]
+                for key in cache_keys
+                if key in _process_cache
+            }
+
+    @staticmethod
+    def _set_to_process_cache(cache_key: str, config: CourseConfig) -> None:
+        with _process_cache_lock:
+            _process_cache[cache_key] = config
+
     @staticmethod
     def get_or_none(course_key: str, source: ConfigSource = ConfigSource.PUBLISH) -> Optional[CourseConfig]:
         '''
@@ -348,6 +386,12 @@ class CourseConfig:
         '''
         cache_key = CourseConfig.cache_key(course_key, source)
 
+        # Try the version loaded by this process.
+        with _process_cache_lock:
+            config = _process_cache.get(cache_key)
+        if config is not None and config.is_valid():
+            return config
+
         # Try cached version.
         try:
             config = cache.get(cache_key)
@@ -355,6 +399,7 @@ class CourseConfig:
             LOGGER.error(f"Failed to get config from cache: {e}")
         else:
             if config and config.is_valid():
+                CourseConfig._set_to_process_cache(cache_key, config)
                 return config
 
         LOGGER.debug('Loading course "%s"' % (course_key))
@@ -365,6 +410,7 @@ class CourseConfig:
             cache.set(cache_key, config)
         except ValueError as e:
             LOGGER.error(f"Failed to set config to cache: {e}")
+        CourseConfig._set_to_process_cache(cache_key, config)
 
         if source == ConfigSource.PUBLISH:
             if not static_path(config).exists():
@@ -398,24 +444,22 @@ class CourseConfig:
         # maybe try loading the types into partial pydantic objects first?
         if "modules" in data:
             if "module_types" in data:
+                module_types = data.pop("module_types")
                 for i, module in enumerate(data["modules"]):
-                    data["modules"][i] = _type_dict(module, data["module_types"])
-
-                del data["module_types"]
+                    data["modules"][i] = _type_dict(module, module_types)
 
             if "exercise_types" in data:
+                exercise_types = data.pop("exercise_types")
                 def apply_exercise_types(parent: Dict[str, Any]) -> None:
                     if "children" not in parent:
                         return
                     for i, exercise_vars in enumerate(parent["children"]):
                         if "key" in exercise_vars:
-                            parent["children"][i] = _type_dict(exercise_vars, data["exercise_types"])
+                            parent["children"][i] = _type_dict(exercise_vars, exercise_types)
                         apply_exercise_types(exercise_vars)
                 for module in data["modules"]:
                     apply_exercise_types(module)
 
-                del data["exercise_types"]
-
         grader_config_dir = CourseConfig._conf_dir(course_dir, meta)
 
         course = Course.parse_obj(data)
@@ -474,8 +518,8 @@ class CourseConfig:
 
     @staticmethod
     def read_defaults(key: str, source: ConfigSource = ConfigSource.PUBLISH) -> dict:
-        with open(CourseConfig.defaults_path(key, source)) as file:
-            return json.load(file)
+        with open(CourseConfig.defaults_path(key, source), "rb") as file:
+            return orjson.loads(file.read())
 
     @staticmethod
     def _conf_dir(course_dir, meta):
@@ -503,7 +547,11 @@ class CourseConfig:
             return l
         return DEFAULT_LANG
 
-    def _check_include_file_timestamps(self, exercise_config: ExerciseConfig) -> bool:
+    def _check_include_file_timestamps(
+            self,
+            exercise_config: ExerciseConfig,
+            include_mtimes: Optional[Dict[str, Optional[float]]] = None,
+            ) -> bool:
         """Check the exercise modification time against the modification timestamps
         of the included configuration templates.
 
@@ -511,17 +559,28 @@ class CourseConfig:
         (if they are used).
 
         @param exercise_config: the exercise ExerciseConfig
+        @param include_mtimes: modification times of the already checked include
+            files (None if the file is missing). Updated with the new files.
         @return: True if the exercise is up-to-date
             (not older than the latest modification in included files)
         """
         course_dir = CourseConfig._conf_dir(self.dir, self.meta)
+        if include_mtimes is None:
+            include_mtimes = {}
 
-        max_include_timestamp = 0
+        max_include_timestamp = 0.0
         for data in exercise_config.data.values():
             for include_data in data.get("include", []):
-                include_file = ConfigParser.get_config(os.path.join(course_dir, include_data["file"]))
-                try:
-                    max_include_timestamp = max(max_include_timestamp, os.path.getmtime(include_file))
-                except OSError:
+                file = include_data["file"]
+                if file not in include_mtimes:
+                    include_file = ConfigParser.get_config(os.path.join(course_dir, file))
+                    try:
+                        include_mtimes[file] = os.path.getmtime(include_file)
+                    except OSError:
+                        include_mtimes[file] = None
+
+                mtime = include_mtimes[file]
+                if mtime is None:
                     return False
+                max_include_timestamp = max(max_include_timestamp, mtime)
         return exercise_config.mtime >= max_include_timestamp
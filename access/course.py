@@ -86,9 +86,7 @@ class ExerciseConfig(PydanticModel):
         # Try to find version for requested or configured language.
         for lang in (lang, self.default_lang):
             if lang in self.data:
-                data = self.data[lang]
-                data["lang"] = lang
-                return data
+                return {**self.data[lang], "lang": lang}
 
         # Fallback to any existing language version.
         return list(self.data.values())[0]
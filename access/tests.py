@@ -3,16 +3,23 @@
 This module holds unit tests.
 '''
 import copy
+import json
 import os
 import time
 import tempfile
+from unittest.mock import patch
 
+from aplus_auth import settings as auth_settings
 from django.conf import settings
-from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
 
-from access.config import CourseConfig
+from access.config import CourseConfig, _type_dict
 from access.parser import ConfigParser
+from access.views import _filter_fields
 from builder.models import Course as CourseModel
+from util import export
 from util.files import rm_path
 
 
@@ -51,6 +58,18 @@ class ConfigTestCase(TestCase):
         self.assertGreater(len(course_configs), 0, "No courses configured")
         return course_configs[0].key
 
+    def export_modules(self, course_key, exercise_defaults):
+        config = CourseConfig.get(course_key)
+        urls = export.ExportURLs(RequestFactory().get("/"), course_key)
+        errors = []
+        modules = []
+        for m in config.data.modules:
+            mf = m.dict(exclude=export.EXCLUDE_CHILDREN, by_alias=True)
+            mf["children"] = export.children(urls, config, m, exercise_defaults, errors, {})
+            modules.append(mf)
+        self.assertEqual(errors, [])
+        return export.json_dumps(modules)
+
     def test_rst_parsing(self):
         from access.parser import get_rst_as_html
         self.assertEqual(get_rst_as_html('A **foobar**.'), '<p>A <strong>foobar</strong>.</p>\n')
@@ -64,6 +83,130 @@ class ConfigTestCase(TestCase):
         self.assertEqual(data["fi"]["title"], "Eräs otsikko")
         self.assertEqual(data["fi"]["nested"]["number"], 2)
 
+    def test_type_dict(self):
+        types = {"mcq": {"category": "mcqcat", "max_points": 10}}
+        item = {"key": "a"}
+        self.assertIs(_type_dict(item, types), item)
+        item = {"key": "a", "type": "unknown"}
+        self.assertIs(_type_dict(item, types), item)
+        self.assertEqual(
+            _type_dict({"key": "a", "type": "mcq", "max_points": 5}, types),
+            {"category": "mcqcat", "max_points": 5, "key": "a"},
+        )
+        self.assertEqual(types, {"mcq": {"category": "mcqcat", "max_points": 10}})
+
+    def test_filter_fields(self):
+        entries = [
+            {"key": "a", "title": "A", "max_points": 10},
+            {"key": "b", "title": "B"},
+        ]
+        self.assertEqual(
+            _filter_fields(entries, ["key", "title"]),
+            [{"key": "a", "title": "A"}, {"key": "b", "title": "B"}],
+        )
+        self.assertEqual(_filter_fields(entries, ["key"]), [{"key": "a"}, {"key": "b"}])
+        self.assertEqual(_filter_fields(entries, []), [{}, {}])
+        with self.assertRaises(KeyError):
+            _filter_fields(entries, ["key", "max_points"])
+
+    def test_unused_type_templates(self):
+        with tempfile.TemporaryDirectory(dir=settings.TESTDATADIR) as root_dir:
+            os.mkdir(os.path.join(root_dir, "types_course"))
+            with open(os.path.join(root_dir, "types_course", "index.yaml"), "w") as f:
+                f.write(
+                    "name: Types\n"
+                    "modules:\n"
+                    "  - key: m\n"
+                    "    name: M\n"
+                    "    children:\n"
+                    "      - key: c\n"
+                    "        title: C\n"
+                    "        static_content: c.html\n"
+                    "        category: cat\n"
+                    "categories:\n"
+                    "  cat:\n"
+                    "    name: Cat\n"
+                    "module_types:\n"
+                    "exercise_types:\n"
+                    "  unused: not a dict\n"
+                )
+            config = CourseConfig._load(root_dir, "types_course")
+            self.assertEqual(config.data.modules[0].key, "m")
+
+    def test_export_twice(self):
+        course_key = self.get_course_key()
+        first = self.export_modules(course_key, {})
+        self.assertEqual(self.export_modules(course_key, {}), first)
+
+        config = CourseConfig.get(course_key)
+        exercise_root = config.exercise_config("arithmetic")
+        data = copy.deepcopy(exercise_root.data)
+        config.get_exercise_list()
+        self.assertEqual(exercise_root.data, data)
+
+    def test_export_exercise_defaults(self):
+        course_key = self.get_course_key()
+        exercise_defaults = {"arithmetic": {"grading_mode": "best", "status": "ready"}}
+        modules = json.loads(self.export_modules(course_key, exercise_defaults))
+        exercise = modules[0]["children"][0]
+        self.assertEqual(exercise["key"], "arithmetic")
+        self.assertEqual(exercise["grading_mode"], "best")
+        self.assertEqual(exercise["status"], "ready")
+        exercise = modules[1]["children"][0]["children"][0]
+        self.assertEqual(exercise["key"], "arithmetic")
+        self.assertEqual(exercise["grading_mode"], "best")
+        self.assertEqual(exercise["status"], "unlisted")
+        self.assertEqual(exercise_defaults, {"arithmetic": {"grading_mode": "best", "status": "ready"}})
+
+    def test_form_fields_extra_info(self):
+        exercises = [
+            {
+                "view_type": "access.types.stdsync.createForm",
+                "fieldgroups": [{"fields": [
+                    {"title": "Q", "extra_info": {"validationMessage": "Enter a number"}},
+                ]}],
+            }
+            for _ in range(2)
+        ]
+        data = copy.deepcopy(exercises)
+        first = export.form_fields(("en", "fi"), exercises)
+        self.assertEqual(first[0][0]["validationMessage"], "i18n_Enter_a_number")
+        self.assertEqual(export.form_fields(("en", "fi"), exercises), first)
+        self.assertEqual(exercises, data)
+
+    def publish_version(self, course_key):
+        version_path = CourseConfig.version_id_path(course_key)
+        defaults_path = CourseConfig.defaults_path(course_key)
+        with open(version_path, "w") as f:
+            f.write("test_version")
+        with open(defaults_path, "w") as f:
+            f.write("{}")
+        self.addCleanup(rm_path, version_path)
+        self.addCleanup(rm_path, defaults_path)
+        cache.clear()
+
+    def test_aplus_json_etag(self):
+        course_key = self.get_course_key()
+        self.publish_version(course_key)
+        url = reverse("aplus-json", args=[course_key])
+        with patch.object(auth_settings(), "DISABLE_LOGIN_CHECKS", True):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("ETag", response)
+            etag = response["ETag"]
+            body = response.content
+            self.assertEqual(json.loads(body)["errors"], [])
+
+            # from the cache
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["ETag"], etag)
+            self.assertEqual(response.content, body)
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["ETag"], etag)
+
     def test_cache(self):
         course_key = self.get_course_key()
 
@@ -1,21 +1,23 @@
-import json
+import hashlib
 from json.decoder import JSONDecodeError
 import logging
+from operator import itemgetter
 import os.path
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 from aplus_auth.auth.django import Request
 from django.conf import settings
-from django.http import HttpRequest, HttpResponse, JsonResponse, Http404
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse, JsonResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.utils import translation
+from django.utils.cache import get_conditional_response
 from django.urls import reverse
 from django.views import View
 from pydantic.error_wrappers import ValidationError
 
 from access.config import ConfigSource, CourseConfig
-from access.course import Exercise, Chapter, Parent
 from access.parser import ConfigError
 from builder import builder
 from builder.configure import configure_graders
@@ -41,7 +43,7 @@ def index(request):
     course_configs, errors = CourseConfig.get_many(course_keys)
 
     if is_ajax(request):
-        return JsonResponse({
+        return _json_response({
             "ready": True,
             "courses": [{"key": c.key, "name": c.data.name} for c in course_configs]
         })
@@ -63,6 +65,7 @@ def course(request, course_key):
     error = None
     course_config = None
     exercises = None
+    etag = None
     try:
         course_config = CourseConfig.get(course_key)
     except ConfigError as e:
@@ -71,6 +74,11 @@ def course(request, course_key):
         if course_config is None:
             error = "Failed to load course config (has it been built and published?)"
         else:
+            if is_ajax(request) and course_config.version_id is not None:
+                etag = _etag(f"course|{course_key}|{course_config.version_id}")
+                response = _not_modified_response(request, etag)
+                if response is not None:
+                    return response
             exercises = course_config.get_exercise_list()
 
     if is_ajax(request):
@@ -85,7 +93,10 @@ def course(request, course_key):
                 "course_name": course_config.data.name,
                 "exercises": _filter_fields(exercises, ["key", "title"]),
             }
-        return JsonResponse(data)
+        response = _json_response(data)
+        if etag is not None:
+            response["ETag"] = etag
+        return response
 
     render_context = {
         'course_name': course_config.course_name if course_config is not None else course_key,
@@ -144,16 +155,18 @@ def serve_exercise_file(request, course_key, exercise_key, basename, dict_key, t
     except StopIteration:
         raise Http404()
 
+    # The file is sent by the web server (X-Sendfile) or streamed so that the
+    # WSGI server can send it with sendfile
     try:
-        with open(CourseConfig.path_to(course.key, path)) as f:
-            content = f.read()
+        response = FileResponse(CourseConfig.relative_path_to(course.key, path), content_type='text/plain')
     except FileNotFoundError as error:
         raise Http404(f"{type} file missing") from error
     except OSError as error:
         logger.error(f'Error in reading the exercise model file "{path}".', exc_info=error)
-        content = str(error)
-
-    return HttpResponse(content, content_type='text/plain')
+        return HttpResponse(str(error), content_type='text/plain')
+    # The file is shown as plain text like before, without a file name
+    del response["Content-Disposition"]
+    return response
 
 
 @login_required
@@ -190,8 +203,8 @@ def aplus_json(request: HttpRequest, course_key: str) -> HttpResponse:
         return None
 
     errors = []
-    def error_response() -> JsonResponse:
-        return JsonResponse({ "success": False, "errors": errors })
+    def error_response() -> HttpResponse:
+        return _json_response({ "success": False, "errors": errors })
 
     course = get_object_or_404(Course, key=course_key)
     if not course.has_read_access(request, True):
@@ -252,6 +265,26 @@ def aplus_json(request: HttpRequest, course_key: str) -> HttpResponse:
 
         source = ConfigSource.PUBLISH
 
+    # The graders need to be configured on every request if the build skipped it,
+    # so the response is cached only when that isn't the case
+    cache_key = None
+    if not course.skip_build_failsafes and not errors:
+        cache_key = _aplus_json_cache_key(request, config, source)
+    if cache_key is not None:
+        # The response only depends on the cache key, so A+ can skip downloading
+        # it again if it still has the same version
+        etag = _etag(cache_key)
+        response = _not_modified_response(request, etag)
+        if response is not None:
+            return response
+
+        body = cache.get(cache_key)
+        if body is not None:
+            # Only error-free responses are cached, so they can be given an ETag
+            response = HttpResponse(body, content_type="application/json")
+            response["ETag"] = etag
+            return response
+
     # configure graders if it was skipped during the build
     if course.skip_build_failsafes:
         # send configs to graders' stores
@@ -265,8 +298,8 @@ def aplus_json(request: HttpRequest, course_key: str) -> HttpResponse:
 
         try:
             with FileLock(path, write=True, timeout=settings.APLUS_JSON_FILELOCK_TIMEOUT):
-                with open(defaults_path, "w") as f:
-                    json.dump(exercise_defaults, f)
+                with open(defaults_path, "wb") as f:
+                    f.write(export.json_dumps(exercise_defaults))
         except BlockingIOError:
             errors.append(
                 "Failed to write exercise defaults as something has a lock on the config directory. Try again later."
@@ -279,41 +312,39 @@ def aplus_json(request: HttpRequest, course_key: str) -> HttpResponse:
 
     data = config.data.dict(exclude={"modules", "static_dir", "unprotected_paths"}, by_alias=True)
 
-    # TODO: this should really be done before the course validation happens
-    def children_recursion(config: CourseConfig, parent: Parent) -> List[Dict[str, Any]]:
-        result: List[Dict[str, Any]] = []
-        for o in parent.children:
-            of = o.dict(exclude={"children"}, by_alias=True)
-            if isinstance(o, Exercise) and o.config:
-                try:
-                    exercise = config.exercise_config(o.key)
-                except ConfigError as e:
-                    errors.append(str(e))
-                    continue
-                data = exercise_defaults.get(o.key, {})
-                data.update(export.exercise(request, config, exercise, of))
-            elif isinstance(o, Chapter):
-                data = export.chapter(request, config, of)
-            else: # any other exercise type
-                data = of
-            data["children"] = children_recursion(config, o)
-            result.append(data)
-        return result
-
-    modules = []
-    for m in config.data.modules:
-        mf = m.dict(exclude={"children"}, by_alias=True)
-        mf["children"] = children_recursion(config, m)
-        modules.append(mf)
-    data["modules"] = modules
-
-    data["build_log_url"] = request.build_absolute_uri(reverse("build-log-json", args=(course_key, )))
-    data["errors"] = errors
+    build_log_url = request.build_absolute_uri(reverse("build-log-json", args=(course_key, )))
     if config.version_id is None:
-        data["publish_url"] = request.build_absolute_uri(reverse("publish", args=(course_key, source)))
+        publish_url = request.build_absolute_uri(reverse("publish", args=(course_key, source)))
     else:
-        data["publish_url"] = request.build_absolute_uri(reverse("publish", args=(course_key, source, config.version_id)))
-    return JsonResponse(data, encoder=export.JSONEncoder)
+        publish_url = request.build_absolute_uri(reverse("publish", args=(course_key, source, config.version_id)))
+
+    urls = export.ExportURLs(request, course_key)
+    include_mtimes: Dict[str, Optional[float]] = {}
+    def modules() -> Iterator[Dict[str, Any]]:
+        for m in config.data.modules:
+            mf = m.dict(exclude=export.EXCLUDE_CHILDREN, by_alias=True)
+            mf["children"] = export.children(urls, config, m, exercise_defaults, errors, include_mtimes)
+            yield mf
+
+    # The modules are exported and serialized one at a time, so that the dicts
+    # of the whole course aren't held in memory at once. The JSON is still
+    # built before responding, so that an error in the export gives a 500
+    # instead of a cut-off response.
+    chunks = list(export.json_stream(data, "modules", modules(), lambda: {
+        "build_log_url": build_log_url,
+        "errors": errors,
+        "publish_url": publish_url,
+    }))
+
+    if cache_key is not None and not errors:
+        body = b"".join(chunks)
+        cache.set(cache_key, body)
+        response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        return response
+
+    # Send the chunks as they are to avoid joining them into another copy
+    return StreamingHttpResponse(chunks, content_type="application/json")
 
 
 @login_required
@@ -392,10 +423,39 @@ def _filter_fields(dict_list, pick_fields):
     @rtype: C{list}
     @return: a list of filtered dictionaries
     '''
-    result = []
-    for entry in dict_list:
-        new_entry = {}
-        for name in pick_fields:
-            new_entry[name] = entry[name]
-        result.append(new_entry)
-    return result
+    if len(pick_fields) <= 1:
+        return [{name: entry[name] for name in pick_fields} for entry in dict_list]
+    get_fields = itemgetter(*pick_fields)
+    return [dict(zip(pick_fields, get_fields(entry))) for entry in dict_list]
+
+
+def _json_response(data: Any) -> HttpResponse:
+    return HttpResponse(export.json_dumps(data), content_type="application/json")
+
+
+def _etag(key: str) -> str:
+    return f'"{hashlib.md5(key.encode()).hexdigest()}"'
+
+
+def _not_modified_response(request: HttpRequest, etag: str) -> Optional[HttpResponse]:
+    '''
+    Returns a 304 (or 412) response with the ETag if the request's conditional
+    headers match the etag, otherwise None.
+    '''
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response["ETag"] = etag
+    return response
+
+
+def _aplus_json_cache_key(request: HttpRequest, config: CourseConfig, source: ConfigSource) -> Optional[str]:
+    '''
+    Returns the cache key for the aplus-json response of the config, or None if
+    the response should not be cached. The version id changes on every build,
+    so only versioned configs are cached.
+    '''
+    if config.version_id is None:
+        return None
+    # the response contains absolute URLs, so it depends on the requested host
+    host = hashlib.md5(request.build_absolute_uri("/").encode()).hexdigest()
+    return f"aplus-json|{source.value}|{config.key}|{config.version_id}|{host}"
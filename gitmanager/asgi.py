@@ -0,0 +1,19 @@
+"""
+ASGI config for gitmanager project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gitmanager.settings")
+
+import sys
+path = os.path.dirname(os.path.dirname(__file__))
+if path not in sys.path:
+	sys.path.append(path)
+
+from django.core.asgi import get_asgi_application
+application = get_asgi_application()
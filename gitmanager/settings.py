@@ -145,6 +145,7 @@ ROOT_URLCONF = 'gitmanager.urls'
 # LOGIN_REDIRECT_URL = "/"
 # LOGIN_ERROR_URL = "/login/"
 WSGI_APPLICATION = 'gitmanager.wsgi.application'
+ASGI_APPLICATION = 'gitmanager.asgi.application'
 
 # Database (override in local_settings.py)
 # https://docs.djangoproject.com/en/1.7/ref/settings/#databases
@@ -1,49 +1,141 @@
+from functools import lru_cache
 from itertools import zip_longest
 from pathlib import Path
-from typing import Any, Dict, Tuple, cast
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Pattern, Tuple, cast
+from urllib.parse import quote
 
+from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
 from django.http import HttpRequest
-from django.urls import reverse
+from django.urls import NoReverseMatch, get_resolver, get_script_prefix, get_urlconf, reverse
+from django.urls.converters import StringConverter
+from django.utils.encoding import iri_to_uri
+from django.utils.http import RFC3986_SUBDELIMS
+import orjson
 from pydantic.networks import AnyHttpUrl
 
-from util.static import static_url_path
+from util.typing import PathLike
 from access.config import CourseConfig
-from access.course import ExerciseConfig
-
-
-def url_to_model(request: HttpRequest, course_key: str, exercise_key: str, basename: str):
-    return request.build_absolute_uri(
-        reverse('model', args=[course_key, exercise_key, basename])
+from access.course import Chapter, Exercise, ExerciseConfig, Parent
+from access.parser import ConfigError
+
+
+# the characters that reverse leaves unquoted in the URL arguments
+_URL_SAFE = RFC3986_SUBDELIMS + "/~:@"
+
+
+class URLTemplate(NamedTuple):
+    ''' A URL pattern reversed into a format string, see url_template '''
+    viewname: str
+    format: str
+    # the converter of each argument and its compiled regex
+    converters: Tuple[Tuple[Any, Pattern[str]], ...]
+
+
+def url_template(viewname: str, nargs: int) -> URLTemplate:
+    '''
+    Reverses a URL pattern into a format string with a positional field for
+    each argument. Use fill_url_template to fill it in.
+    '''
+    return _url_template(viewname, nargs, get_script_prefix(), get_urlconf() or settings.ROOT_URLCONF)
+
+
+# The templates only depend on the URLconf and the script prefix, so they are
+# reversed only once per process
+@lru_cache(maxsize=64)
+def _url_template(viewname: str, nargs: int, script_prefix: str, urlconf: Any) -> URLTemplate:
+    placeholders = [f"__arg{i}__" for i in range(nargs)]
+    template = reverse(viewname, urlconf=urlconf, args=placeholders).replace("{", "{{").replace("}", "}}")
+    for i, placeholder in enumerate(placeholders):
+        template = template.replace(placeholder, f"{{{i}}}")
+
+    # reverse checks the arguments against the converters of the first
+    # pattern with the same number of parameters, so do the same
+    params, converters = next(
+        (params, converters)
+        for possibilities, _, _, converters in get_resolver(urlconf).reverse_dict.getlist(viewname)
+        for _, params in possibilities
+        if len(params) == nargs
     )
-
-
-def url_to_template(request: HttpRequest, course_key: str, exercise_key: str, basename: str):
-    return request.build_absolute_uri(
-        reverse('exercise_template', args=[course_key, exercise_key, basename])
+    # a parameter without a converter matches like <str:...>
+    arg_converters = tuple(converters.get(param, StringConverter()) for param in params)
+    return URLTemplate(
+        viewname,
+        template,
+        tuple((c, re.compile(c.regex)) for c in arg_converters),
     )
 
 
-def url_to_static(request: HttpRequest, course_key: str, path: str) -> str:
-    ''' Creates an URL for a path in static files '''
-    return request.build_absolute_uri(static_url_path(course_key, path))
-
-
-def chapter(request: HttpRequest, course: CourseConfig, of: Dict[str, Any]) -> Dict[str, Any]:
+def fill_url_template(template: URLTemplate, *args: Any) -> str:
+    '''
+    Fills in a template from url_template. Like reverse, the arguments are
+    converted and checked with the converters of the URL pattern, and quoted.
+    Raises NoReverseMatch if an argument does not match its converter.
+    '''
+    values = []
+    for (converter, regex), arg in zip(template.converters, args):
+        value = str(converter.to_url(arg))
+        if not regex.fullmatch(value):
+            raise NoReverseMatch(
+                f"Reverse for '{template.viewname}' with arguments '{args}' not found. "
+                f"'{value}' does not match the pattern '{converter.regex}'."
+            )
+        values.append(quote(value, safe=_URL_SAFE))
+    return template.format.format(*values)
+
+
+class ExportURLs:
+    '''
+    Creates the absolute URLs to the files of a course. The URL patterns are
+    reversed and the scheme and host are resolved only once, as doing it for
+    every file of a large course is slow.
+    '''
+    def __init__(self, request: HttpRequest, course_key: str):
+        self.request = request
+        self.course_key = course_key
+        # scheme and host without the trailing slash
+        self._base = request.build_absolute_uri("/")[:-1]
+        self._model = url_template('model', 3)
+        self._template = url_template('exercise_template', 3)
+        # STATIC_URL always ends in a slash and the static paths are relative
+        self._static = f"{settings.STATIC_URL}{course_key}/"
+
+    def absolute(self, path: str) -> str:
+        '''
+        Same as request.build_absolute_uri(path) but skips parsing the URL for
+        the usual case of an absolute path.
+        '''
+        if path.startswith("/") and not path.startswith("//") and "/./" not in path and "/../" not in path:
+            return self._base + iri_to_uri(path)
+        return self.request.build_absolute_uri(path)
+
+    def model(self, exercise_key: str, basename: str) -> str:
+        return self.absolute(fill_url_template(self._model, self.course_key, exercise_key, basename))
+
+    def template(self, exercise_key: str, basename: str) -> str:
+        return self.absolute(fill_url_template(self._template, self.course_key, exercise_key, basename))
+
+    def static(self, path: PathLike) -> str:
+        ''' Creates an URL for a path in static files '''
+        return self.absolute(f"{self._static}{path}")
+
+
+def chapter(urls: ExportURLs, course: CourseConfig, of: Dict[str, Any]) -> Dict[str, Any]:
     ''' Exports chapter data '''
     path = of.pop('static_content')
     if type(path) == dict:
         of['url'] = {
-            lang: url_to_static(request, course.key, p)
+            lang: urls.static(p)
             for lang,p in path.items()
         }
     else:
-        of['url'] = url_to_static(request, course.key, path)
+        of['url'] = urls.static(path)
     return of
 
 
 def exercise(
-        request: HttpRequest,
+        urls: ExportURLs,
         course: CourseConfig,
         exercise_root: ExerciseConfig,
         of: Dict[str, Any]
@@ -110,7 +202,7 @@ def exercise(
     elif 'model_files' in exercise:
         of['model_answer'] = i18n_urls(
             languages, exercises, 'model_files',
-            url_to_model, request, course.key, exercise['key']
+            urls.model, exercise['key']
         )
 
     if 'exercise_template' in exercise:
@@ -118,12 +210,63 @@ def exercise(
     elif 'template_files' in exercise:
         of['exercise_template'] = i18n_urls(
             languages, exercises, 'template_files',
-            url_to_template, request, course.key, exercise['key']
+            urls.template, exercise['key']
         )
 
     return of
 
 
+# the fields left out when exporting a module or a child, as the children are exported separately
+EXCLUDE_CHILDREN = frozenset(("children",))
+
+
+# TODO: this should really be done before the course validation happens
+def children(
+        urls: ExportURLs,
+        course: CourseConfig,
+        parent: Parent,
+        exercise_defaults: Dict[str, Any],
+        errors: List[str],
+        include_mtimes: Optional[Dict[str, Optional[float]]] = None,
+        ) -> List[Dict[str, Any]]:
+    '''
+    Exports the children of a module or a chapter and their descendants.
+    The tree is walked with an explicit stack instead of recursion, in the
+    same (depth first) order.
+
+    Pass the same include_mtimes dict when exporting several modules so that
+    the files included by the exercise configs are checked only once.
+    '''
+    if include_mtimes is None:
+        include_mtimes = {}
+    result: List[Dict[str, Any]] = []
+    # (child, the exported list of its siblings)
+    stack: List[Tuple[Parent, List[Dict[str, Any]]]] = [(o, result) for o in reversed(parent.children)]
+    while stack:
+        o, siblings = stack.pop()
+        of = o.dict(exclude=EXCLUDE_CHILDREN, by_alias=True)
+        if isinstance(o, Exercise) and o.config:
+            try:
+                exercise_root = course.exercise_config(o.key, include_mtimes)
+            except ConfigError as e:
+                errors.append(str(e))
+                continue
+            of = exercise(urls, course, exercise_root, of)
+            # use the exported dict as is if there are no defaults to merge it into.
+            # The defaults are not updated in place as the same exercise may
+            # appear several times in the course.
+            defaults = exercise_defaults.get(o.key)
+            data = of if defaults is None else {**defaults, **of}
+        elif isinstance(o, Chapter):
+            data = chapter(urls, course, of)
+        else: # any other exercise type
+            data = of
+        data["children"] = []
+        siblings.append(data)
+        stack.extend((c, data["children"]) for c in reversed(o.children))
+    return result
+
+
 def form_fields(languages, exercises):
     ''' Describes a form that the configured exercise produces '''
 
@@ -179,7 +322,8 @@ def form_fields(languages, exercises):
 
         if 'extra_info' in f:
             es = list_get(fs, 'extra_info', {})
-            extra = es[0]
+            # copied as the exercise data is shared by the requests of the process
+            extra = es[0].copy()
             for key in ['validationMessage']:
                 if key in extra:
                     extra[key] = i18n_map(list_get(es, key, ''))
@@ -256,10 +400,10 @@ def i18n_get(languages, values, key):
     }
 
 
-def i18n_urls(languages, values, key, mapper, request, course_key, exercise_key):
+def i18n_urls(languages, values, key, mapper, exercise_key):
     def urls(paths, lang=None):
         return ' '.join([
-            mapper(request, course_key, exercise_key, path.split('/')[-1]) +
+            mapper(exercise_key, path.split('/')[-1]) +
             ('?lang='+lang if lang else '')
             for path in paths
         ])
@@ -287,3 +431,44 @@ class JSONEncoder(DjangoJSONEncoder):
         if isinstance(obj, AnyHttpUrl) or isinstance(obj, Path):
             return str(obj)
         return super().default(obj)
+
+
+_json_default = JSONEncoder().default
+
+
+def json_dumps(data: Any) -> bytes:
+    '''
+    Serializes data to JSON. The output matches JSONEncoder, e.g. datetimes
+    are formatted the Django way, but the encoding is done by orjson.
+    '''
+    return orjson.dumps(
+        data,
+        default=_json_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+    )
+
+
+def json_stream(
+        head: Dict[str, Any],
+        key: str,
+        items: Iterable[Any],
+        tail: Callable[[], Dict[str, Any]],
+        ) -> Iterator[bytes]:
+    '''
+    Serializes a JSON object in chunks: the fields in head, then the list of
+    items under key, then the fields returned by tail. Each item is
+    serialized as soon as it is produced, and tail is called after the last item.
+    '''
+    start = json_dumps(head)[:-1]
+    if head:
+        start += b","
+    yield start + json_dumps(key) + b":["
+    for i, item in enumerate(items):
+        if i:
+            yield b"," + json_dumps(item)
+        else:
+            yield json_dumps(item)
+    end = json_dumps(tail())[1:]
+    if end != b"}":
+        end = b"," + end
+    yield b"]" + end
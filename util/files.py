@@ -11,7 +11,7 @@ import subprocess
 import tempfile
 import time
 from types import TracebackType
-from typing import Dict, Generator, Iterable, List, Optional, Set, Tuple, Type, Union
+from typing import Any, Dict, Generator, Iterable, List, Optional, Set, Tuple, Type, Union
 
 from django.conf import settings
 from django.http.response import FileResponse as DjangoFileResponse, HttpResponse
@@ -350,13 +350,13 @@ class FileLock:
 
 
 class StreamingFileResponse(DjangoFileResponse):
-    def __init__(self, path: str):
-        super().__init__(open(os.path.join(settings.COURSES_PATH, path), "rb"))
+    def __init__(self, path: str, **kwargs: Any):
+        super().__init__(open(os.path.join(settings.COURSES_PATH, path), "rb"), **kwargs)
 
 
 class XSendFileResponse(HttpResponse):
-    def __init__(self, path: str):
-        super().__init__()
+    def __init__(self, path: str, **kwargs: Any):
+        super().__init__(**kwargs)
         self["X-Accel-Redirect"] = os.path.join("/authorized_static", path)
 
 
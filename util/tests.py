@@ -2,7 +2,9 @@ import os.path
 
 from django.conf import settings
 from django.test import TestCase, override_settings
+from django.urls import NoReverseMatch, reverse
 
+from .export import fill_url_template, json_dumps, json_stream, url_template
 from .git import get_diff_names, git_call
 
 
@@ -70,3 +72,35 @@ class GitTest(TestCase):
 
         _, changed_files = get_diff_names(self.git_dir, "nonexistentcommit")
         self.assertIsNone(changed_files)
+
+
+class ExportTest(TestCase):
+    def test_url_template(self) -> None:
+        for viewname in ("model", "exercise_template"):
+            template = url_template(viewname, 3)
+            for args in (
+                    ("test_course", "hello_python", "model.py"),
+                    ("test-course", "exercise_1", "tiedosto-ä.txt"),
+                    ("test_course", "exercise", ""),
+                    ):
+                self.assertEqual(fill_url_template(template, *args), reverse(viewname, args=args))
+            for args in (
+                    ("test_course", "hello_python", "model file.py"),
+                    ("test_course", "hello.python", "model.py"),
+                    ("test course", "hello_python", "model.py"),
+                    ):
+                with self.assertRaises(NoReverseMatch):
+                    reverse(viewname, args=args)
+                with self.assertRaises(NoReverseMatch):
+                    fill_url_template(template, *args)
+
+    def test_json_stream(self) -> None:
+        for head, items, tail in (
+                ({}, [], {}),
+                ({}, [{"a": 1}], {}),
+                ({"name": "course"}, [], {}),
+                ({}, [], {"errors": []}),
+                ({"name": "course", "lang": "en"}, [{"a": 1}, [], 2], {"errors": ["error"], "url": None}),
+                ):
+            chunks = json_stream(head, "modules", iter(items), lambda: tail)
+            self.assertEqual(b"".join(chunks), json_dumps({**head, "modules": items, **tail}))